@@ -3,15 +3,16 @@
 @brief      A class representing an HTML document
 
 @date       8/2/2024
-@updated    8/17/2024
+@updated    10/14/2026
 
 @author     Preston Buterbaugh
 """
 # Imports
+import sys
 from enum import Enum
-from typing import List, Dict
+from typing import List, Dict, TextIO
 
-from htmlwriter.node import Node
+from htmlwriter.node import Node, ATTRIBUTE_ESCAPES, TEXT_ESCAPES, _child_position
 from htmlwriter.exceptions import HTMLWriterException, DOMTreeException
 
 
@@ -24,6 +25,13 @@ class Doctype(Enum):
     XHTML = 2
 
 
+DOCTYPE_DECLARATIONS = {
+    Doctype.HTML5: '<!DOCTYPE html>',
+    Doctype.HTML4: '<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN" "http://www.w3.org/TR/html4/loose.dtd">',
+    Doctype.XHTML: '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">'
+}
+
+
 class Document:
     """
     @brief  Class representing an HTML document
@@ -48,9 +56,13 @@ class Document:
         self.internal_css = ''
         self.css = css
         self.dom_tree = []
+        self._child_index = {}
         self.js = ''
         self.external_js = []
-        self._max_id = 0
+        self._id_index = {}
+        self._tag_cache = {}
+        self._class_cache = {}
+        self._dom_version = 0
 
     def add_metadata(self, metadata: Dict):
         """
@@ -65,17 +77,14 @@ class Document:
         @param  attribute (str): The name of a metadata attribute to remove
         @param  value     (str): The corresponding value of the metadata attribute to remove
         """
-        removed = False
+        remaining_metadata = []
         for meta_tag in self.metadata:
-            for key in meta_tag.keys():
-                if key == attribute and meta_tag[key] == value:
-                    meta_tag.pop(key, None)
-                    removed = True
-                    if len(meta_tag) == 0:
-                        self.metadata.remove(meta_tag)
-                    break
-            if removed:
-                break
+            if attribute in meta_tag and meta_tag[attribute] == value:
+                meta_tag = {key: meta_value for key, meta_value in meta_tag.items() if key != attribute}
+                if not meta_tag:
+                    continue
+            remaining_metadata.append(meta_tag)
+        self.metadata = remaining_metadata
 
     def add_css_file(self, filename: str):
         """
@@ -119,15 +128,41 @@ class Document:
         @param  search_id (str): The ID of the node to retrieve
         @return (Node or None) The matching DOM node, or None if no node with that ID is found
         """
-        for node in self.dom_tree:
-            if 'id' in node.attributes.keys() and node.attributes['id'] == search_id:
+        # A single indexed node is confirmed to still have the ID and be in the DOM tree, as both may have been changed
+        # by editing the node's or the document's fields directly
+        matching_nodes = self._id_index.get(search_id)
+        if matching_nodes and len(matching_nodes) == 1:
+            node = matching_nodes[0]
+            if node.attributes.get('id') == search_id and self._contains(node):
                 return node
-            if type(node.content) is list:
-                sub_node = node.get_by_id(search_id)
-                if sub_node is not None:
-                    return sub_node
+
+        # Either multiple nodes share the ID, no node is indexed under it, or the indexed node has been moved or re-IDed
+        # by editing the DOM tree directly. Search the tree for the first matching node in document order
+        stack = self.dom_tree[::-1]
+        pop = stack.pop
+        push = stack.extend
+        while stack:
+            node = pop()
+            if node.attributes.get('id') == search_id:
+                return node
+            children = node.content
+            if type(children) is list:
+                push(reversed(children))
         return None
 
+    def _contains(self, node: Node) -> bool:
+        """
+        @brief  Checks whether a node is in the DOM tree, at any depth, by following its parent links up to the top level
+                and confirming each one against the child lists
+        @param  node (Node): The node to check
+        @return (bool) True if the node is in the DOM tree
+        """
+        while node._parent is not None:
+            if not node._parent._has_child(node):
+                return False
+            node = node._parent
+        return _child_position(self.dom_tree, self._child_index, node) != -1
+
     def get_by_class_name(self, class_name: str) -> List:
         """
         @brief  Mimics the JavaScript "document.getElementsByClassName()" method by fetching a list of DOM nodes matching
@@ -135,13 +170,25 @@ class Document:
         @param  class_name (str): The class name to search for
         @return (List) A list containing all nodes matching the specified class name
         """
+        cached = self._class_cache.get(class_name)
+        if cached is not None and cached[0] == self._dom_version:
+            return list(cached[1])
+
         matching_nodes = []
-        for node in self.dom_tree:
-            if 'class' in node.attributes.keys() and class_name in node.attributes['class']:
-                matching_nodes.append(node)
-            if type(node.content) is list:
-                matching_nodes = matching_nodes + node.get_by_class_name(class_name)
-        return matching_nodes
+        stack = self.dom_tree[::-1]
+        pop = stack.pop
+        push = stack.extend
+        append = matching_nodes.append
+        while stack:
+            node = pop()
+            classes = node.attributes.get('class')
+            if classes and class_name in classes:
+                append(node)
+            children = node.content
+            if type(children) is list:
+                push(reversed(children))
+        self._class_cache[class_name] = (self._dom_version, matching_nodes)
+        return list(matching_nodes)
 
     def get_by_tag_name(self, tag_name: str) -> List:
         """
@@ -150,13 +197,25 @@ class Document:
         @param  tag_name (str): The name of the HTML tag to search for
         @return (List) A list of all nodes of the specified tag type
         """
+        tag_name = sys.intern(tag_name)
+        cached = self._tag_cache.get(tag_name)
+        if cached is not None and cached[0] == self._dom_version:
+            return list(cached[1])
+
         matching_nodes = []
-        for node in self.dom_tree:
+        stack = self.dom_tree[::-1]
+        pop = stack.pop
+        push = stack.extend
+        append = matching_nodes.append
+        while stack:
+            node = pop()
             if node.tag_name == tag_name:
-                matching_nodes.append(node)
-            if type(node.content) is list:
-                matching_nodes = matching_nodes + node.get_by_tag_name(tag_name)
-        return matching_nodes
+                append(node)
+            children = node.content
+            if type(children) is list:
+                push(reversed(children))
+        self._tag_cache[tag_name] = (self._dom_version, matching_nodes)
+        return list(matching_nodes)
 
     def insert_before(self, before_node: Node, new_node: Node):
         """
@@ -166,47 +225,125 @@ class Document:
         @param  new_node    (Node): The node to be inserted
         """
         # Find the node to insert before
-        before_index = -1
-        for i, node in enumerate(self.dom_tree):
-            if node._node_id == before_node._node_id:
-                before_index = i
-                break
+        before_index = _child_position(self.dom_tree, self._child_index, before_node)
 
         # Raise exception if node was not found
         if before_index == -1:
             raise DOMTreeException('Failed to insert node. The node to insert before is not a child of document.body')
 
         # Insert node
-        self._max_id = self._max_id + 1
-        new_node._update_node_ids(str(self._max_id))
-        self.dom_tree = self.dom_tree[0:before_index] + [new_node] + self.dom_tree[before_index:]
+        new_node._parent = None
+        self._register_ids([new_node])
+        self.dom_tree.insert(before_index, new_node)
 
     def append_child(self, new_node: Node):
         """
         @brief  Mimics the JavaScript "document.appendChild()" method, by inserting a new HTML node to the end of the DOM tree
         @param  new_node (Node): The node to be inserted
         """
-        self._max_id = self._max_id + 1
-        new_node._update_node_ids(str(self._max_id))
+        new_node._parent = None
+        self._register_ids([new_node])
+        self._child_index[new_node._node_id] = len(self.dom_tree)
         self.dom_tree.append(new_node)
 
+    def append_children(self, new_nodes: List):
+        """
+        @brief  Appends several HTML nodes to the end of the DOM tree at once, in the order given
+        @param  new_nodes (List): The nodes to be inserted
+        """
+        new_nodes = list(new_nodes)
+        position = len(self.dom_tree)
+        for new_node in new_nodes:
+            new_node._parent = None
+            self._child_index[new_node._node_id] = position
+            position += 1
+        self._register_ids(new_nodes)
+        self.dom_tree.extend(new_nodes)
+
     def remove_child(self, remove_node: Node):
         """
         @brief  Mimics the JavaScript "document.removeChild()" method, by removing an HTML node from the DOM tree
         @param  remove_node (str): The node to remove
         """
         # Find node to remove
-        remove_index = -1
-        for i, node in enumerate(self.dom_tree):
-            if node._node_id == remove_node._node_id:
-                remove_index = i
-                break
+        remove_index = _child_position(self.dom_tree, self._child_index, remove_node)
 
         # Raise exception if node not found
         if remove_index == -1:
             raise DOMTreeException('Node removal failed. The node to be removed is not a child of document.body')
 
-        self.dom_tree.pop(remove_index)
+        removed_node = self.dom_tree.pop(remove_index)
+        self._child_index.pop(removed_node._node_id, None)
+        self._unregister_ids(removed_node)
+
+    def _dom_changed(self):
+        """
+        @brief  Marks the DOM tree as modified, invalidating any cached tag name and class name search results
+        """
+        self._dom_version += 1
+
+    def _register_id(self, node: Node, value: str):
+        """
+        @brief  Adds a node to the document's ID index
+        @param  node  (Node): The node being indexed
+        @param  value (str):  The ID under which to index the node
+        """
+        if value in self._id_index:
+            self._id_index[value].append(node)
+        else:
+            self._id_index[value] = [node]
+
+    def _unregister_id(self, node: Node):
+        """
+        @brief  Removes a node from the document's ID index, under the ID currently set on the node
+        @param  node (Node): The node to remove from the index
+        """
+        node_id = node.attributes.get('id')
+        if node_id is None:
+            return
+        matching_nodes = self._id_index.get(node_id, [])
+        for i, indexed_node in enumerate(matching_nodes):
+            if indexed_node is node:
+                matching_nodes.pop(i)
+                break
+        if not matching_nodes:
+            self._id_index.pop(node_id, None)
+
+    def _register_ids(self, roots: List):
+        """
+        @brief  Attaches nodes and all of their descendants to the document, adding any IDs they have to the ID index
+        @param  roots (List): The roots of the subtrees being attached
+        """
+        self._dom_changed()
+        stack = list(roots)
+        pop = stack.pop
+        push = stack.extend
+        while stack:
+            node = pop()
+            node._document = self
+            attributes = node.attributes
+            if 'id' in attributes:
+                self._register_id(node, attributes['id'])
+            children = node.content
+            if type(children) is list:
+                push(children)
+
+    def _unregister_ids(self, root: Node):
+        """
+        @brief  Detaches a node and all of its descendants from the document, removing their IDs from the ID index
+        @param  root (Node): The root of the subtree being detached
+        """
+        self._dom_changed()
+        stack = [root]
+        pop = stack.pop
+        push = stack.extend
+        while stack:
+            node = pop()
+            node._document = None
+            self._unregister_id(node)
+            children = node.content
+            if type(children) is list:
+                push(children)
 
     def export(self, filepath: str = 'index.html', indent: str = '    ', line_limit: int = 185):
         """
@@ -215,146 +352,156 @@ class Document:
         @param  indent     (str): A string to use for each indentation in the document. Defaults to four spaces
         @param  line_limit (int): The number of characters after which to wrap a line if possible. Defaults to 185 characters
         """
-        curr_indent = ''
+        # Encode the compiled document once, and write it to the file in a single call
+        data = ''.join(self._build_parts(indent, line_limit)).encode('utf-8', errors='replace')
         try:
-            with open(filepath, 'w', errors='replace') as file:
-                # Set doctype
-                if self.doctype == Doctype.HTML5:
-                    file.write(f'<!DOCTYPE html>')
-                elif self.doctype == Doctype.HTML4:
-                    file.write('<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN" "http://www.w3.org/TR/html4/loose.dtd">')
-                else:
-                    file.write('<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">')
-
-                # Open html and head tags
-                file.write(f'\n{curr_indent}<html>')
-                curr_indent = f'{curr_indent}{indent}'
-                file.write(f'\n{curr_indent}<head>')
-                curr_indent = f'{curr_indent}{indent}'
-
-                # Write meta tags
-                for meta_tag in self.metadata:
-                    file.write(f'\n{curr_indent}<meta')
-                    for attribute in meta_tag.keys():
-                        file.write(f' {attribute}="{meta_tag[attribute]}"')
-                    file.write(' />')
-
-                # Write title tag
-                file.write(f'\n{curr_indent}<title>{self.title}</title>')
-
-                # Write internal CSS
-                if self.internal_css:
-                    file.write(f'\n{curr_indent}<style>')
-                    curr_indent = f'{curr_indent}{indent}'
-                    css_lines = self.internal_css.split('\n')
-                    for line in css_lines:
-                        file.write(f'\n{curr_indent}{line}')
-                    curr_indent = curr_indent[0:len(curr_indent) - len(indent)]
-                    file.write(f'\n{curr_indent}</style>')
-
-                # Create link tags for external CSS
-                for css_file in self.css:
-                    file.write(f'\n{curr_indent}<link rel="stylesheet" href="{css_file}" />')
-
-                # Close head tag and open body tag
-                curr_indent = curr_indent[0:len(curr_indent) - len(indent)]
-                file.write(f'\n{curr_indent}</head>')
-                if len(self.dom_tree) == 0:
-                    file.write(f'\n{curr_indent}<body />')
-                else:
-                    file.write(f'\n{curr_indent}<body>')
-
-                # Write body
-                curr_indent = f'{curr_indent}{indent}'
-                for node in self.dom_tree:
-                    file.write(tag_content(node, curr_indent, indent, line_limit))
-
-                # Write JavaScript
-                if self.js:
-                    file.write(f'\n{curr_indent}<script>')
-                    curr_indent = f'{curr_indent}{indent}'
-                    js_lines = self.js.split('\n')
-                    for line in js_lines:
-                        file.write(f'\n{curr_indent}{line}')
-                    curr_indent = curr_indent[0:len(curr_indent) - len(indent)]
-                    file.write(f'\n{curr_indent}</script>')
-
-                # External JS
-                for script_file in self.external_js:
-                    file.write(f'\n{curr_indent}<script src="{script_file}"></script>')
-
-                # Close body tag
-                curr_indent = curr_indent[0:len(curr_indent) - len(indent)]
-                if self.dom_tree:
-                    file.write(f'\n{curr_indent}</body>')
-
-                # Close html tag
-                curr_indent = curr_indent[0:len(curr_indent) - len(indent)]
-                file.write(f'\n{curr_indent}</html>')
+            with open(filepath, 'wb') as file:
+                file.write(data)
         except FileExistsError:
             print(f'Failed to create file {filepath}. A file with that name already exists')
         except PermissionError:
             print(f'Failed to create file {filepath}. You may not have permission to create files in this location')
 
+    def export_to(self, stream: TextIO, indent: str = '    ', line_limit: int = 185):
+        """
+        @brief  Writes the document in its current state to an open text stream, such as standard output or a socket
+                wrapped in a text stream. The stream is not flushed or closed
+        @param  stream     (TextIO): The stream to write to. Should be buffered, since the document is written as many
+                                     small pieces
+        @param  indent     (str):    A string to use for each indentation in the document. Defaults to four spaces
+        @param  line_limit (int):    The number of characters after which to wrap a line if possible. Defaults to 185 characters
+        """
+        stream.writelines(self._build_parts(indent, line_limit))
 
-def tag_content(tag: Node, indent: str, indent_increment: str, line_limit: int, inline: bool = False) -> str:
+    def _build_parts(self, indent: str, line_limit: int) -> List:
+        """
+        @brief  Compiles the document into HTML text
+        @param  indent     (str): A string to use for each indentation in the document
+        @param  line_limit (int): The number of characters after which to wrap a line if possible
+        @return (List) The HTML text of the document, as a list of text fragments to be written in order
+        """
+        indents = ['', indent]
+        _indent(indents, 3)  # Deepest level used outside the body nodes (internal CSS and JavaScript lines)
+        parts = []
+
+        # Write doctype and open html and head tags
+        parts.append(f'{DOCTYPE_DECLARATIONS[self.doctype]}\n<html>\n{indents[1]}<head>')
+        depth = 2
+        head_indent = f'\n{indents[depth]}'
+
+        # Write meta tags and title tag
+        head_tags = []
+        for meta_tag in self.metadata:
+            meta_attributes = ''.join(f' {attribute}="{str(value).translate(ATTRIBUTE_ESCAPES)}"' for attribute, value in meta_tag.items())
+            head_tags.append(f'{head_indent}<meta{meta_attributes} />')
+        head_tags.append(f'{head_indent}<title>{str(self.title).translate(TEXT_ESCAPES)}</title>')
+        parts.append(''.join(head_tags))
+
+        # Write internal CSS
+        if self.internal_css:
+            css_indent = f'\n{indents[depth + 1]}'
+            css_lines = css_indent.join(self.internal_css.split('\n'))
+            parts.append(f'{head_indent}<style>{css_indent}{css_lines}{head_indent}</style>')
+
+        # Create link tags for external CSS
+        parts.append(''.join(f'{head_indent}<link rel="stylesheet" href="{str(css_file).translate(ATTRIBUTE_ESCAPES)}" />' for css_file in self.css))
+
+        # Close head tag and open body tag. The body tag is only self-closing if nothing at all is written inside it
+        depth = 1
+        parts.append(f'\n{indents[depth]}</head>')
+        if not (self.dom_tree or self.js or self.external_js):
+            parts.append(f'\n{indents[depth]}<body />\n</html>')
+            return parts
+        parts.append(f'\n{indents[depth]}<body>')
+
+        # Write body
+        depth = 2
+        for node in self.dom_tree:
+            _tag_content(node, depth, indents, line_limit, parts)
+
+        # Write JavaScript
+        if self.js:
+            js_indent = f'\n{indents[depth + 1]}'
+            js_lines = js_indent.join(self.js.split('\n'))
+            parts.append(f'\n{indents[depth]}<script>{js_indent}{js_lines}\n{indents[depth]}</script>')
+
+        # External JS
+        parts.append(''.join(f'\n{indents[depth]}<script src="{str(script_file).translate(ATTRIBUTE_ESCAPES)}"></script>' for script_file in self.external_js))
+
+        # Close body and html tags
+        parts.append(f'\n{indents[1]}</body>\n</html>')
+        return parts
+
+
+def _indent(indents: List, depth: int) -> str:
     """
-    @brief  Compiles a Node object into HTML text, given export file information
-    @param  tag              (Node): The tag to parse
-    @param  indent           (str):  The current indentation level of the document
-    @param  indent_increment (str):  The text to add on to the indent when increasing indent level
-    @param  line_limit       (int):  The maximum number of characters to put on a single line before wrapping if possible
-    @param  inline           (bool): If no newline should be included before the tag's contents
-    @return (str) The HTML text of the tag
+    @brief  Gets the indentation text for a given depth, extending the table of indentation levels as needed
+    @param  indents (List): The indentation text for each depth computed so far. The first two entries must be the empty
+                            string and a single indent
+    @param  depth   (int):  The indentation level to get
+    @return (str) The indentation text for the specified depth
     """
-    # Write opening tag
-    if inline:
-        text = ''
-    else:
-        text = f'\n{indent}'
-    text = f'{text}<{tag.tag_name}'
-    for attribute in tag.attributes.keys():
-        if attribute == 'class' and type(tag.attributes[attribute]) is list:
-            value = ' '.join(tag.attributes[attribute])
-        else:
-            value = tag.attributes[attribute]
-        text = f'{text} {attribute}="{value}"'
-    if tag.content is None:
-        text = f'{text} /'
-    text = f'{text}>'
-
-    # Check the tag type (text or tree)
-    if type(tag.content) is str:
-        # Check if it fits on a single line
-        if len(f'{text}{tag.content}</{tag.tag_name}>') <= line_limit:
-            text = f'{text}{tag.content}</{tag.tag_name}>'
-        else:
-            indent = f'{indent}{indent_increment}'
-            remaining_content = tag.content
-            while len(f'{indent}{remaining_content}') > line_limit:
-                single_line = remaining_content[0:line_limit]
-                remaining_content = remaining_content[line_limit:]
-                text = f'{text}\n{indent}{single_line}'
-            text = f'{text}\n{indent}{remaining_content}'
-            indent = indent[0:len(indent) - len(indent_increment)]
-            text = f'{text}\n{indent}</{tag.tag_name}>'
-    elif tag.content is not None:
-        # Anchor tags containing only one tag are printed on the same line
-        if tag.tag_name == 'a' and len(tag.content) == 1:
-            text = f'{text}<a'
-            for attribute in tag.attributes.keys():
-                if attribute == 'class':
-                    value = ' '.join(tag.attributes[attribute])
-                else:
-                    value = tag.attributes[attribute]
-                text = f'{text} {attribute}="{value}"'
-            text = f'{text}>{tag_content(tag.content[0], indent, indent_increment, line_limit, inline=True)}'
-            text = f'{text}</a>'
-        else:
-            indent = f'{indent}{indent_increment}'
-            for child_tag in tag.content:
-                text = f'{text}{tag_content(child_tag, indent, indent_increment, line_limit)}'
-            indent = indent[0:len(indent) - len(indent_increment)]
-            text = f'{text}\n{indent}</{tag.tag_name}>'
+    while len(indents) <= depth:
+        indents.append(f'{indents[-1]}{indents[1]}')
+    return indents[depth]
+
 
-    return text
+def _tag_content(root: Node, depth: int, indents: List, line_limit: int, out: List):
+    """
+    @brief  Compiles a Node object into HTML text, given export file information, appending the text fragments to a
+            shared output list. The tree is walked with an explicit stack, so the depth of the tree is not limited by
+            Python's recursion limit
+    @param  root       (Node): The tag to parse
+    @param  depth      (int):  The current indentation level of the document
+    @param  indents    (List): The table of indentation text for each depth, as used by _indent()
+    @param  line_limit (int):  The maximum number of characters to put on a single line before wrapping if possible
+    @param  out        (List): The list of text fragments to which the HTML text of the tag is appended
+    """
+    # Each stack entry is either a (tag, depth, inline) tuple for a tag still to be opened, or the closing text of a tag
+    # whose children are being written
+    append = out.append
+    extend = out.extend
+    stack = [(root, depth, False)]
+    push = stack.append
+    pop = stack.pop
+    while stack:
+        entry = pop()
+        if type(entry) is str:
+            append(entry)
+            continue
+        tag, depth, inline = entry
+        tag_name = tag.tag_name
+        content = tag.content
+
+        # Write opening tag
+        indent = indents[depth] if depth < len(indents) else _indent(indents, depth)
+        attribute_text = tag._attribute_text()
+        if inline:
+            open_tag = f'<{tag_name}{attribute_text}>' if content is not None else f'<{tag_name}{attribute_text} />'
+        else:
+            open_tag = f'\n{indent}<{tag_name}{attribute_text}>' if content is not None else f'\n{indent}<{tag_name}{attribute_text} />'
+        append(open_tag)
+
+        # Check the tag type (text or tree)
+        if type(content) is str:
+            # Check if it fits on a single line
+            escaped_content = content.translate(TEXT_ESCAPES)
+            if len(open_tag) + len(escaped_content) + len(tag_name) + 3 <= line_limit:
+                append(f'{escaped_content}</{tag_name}>')
+            else:
+                # Lines are split before escaping, so that no character reference is broken across lines
+                content_indent = _indent(indents, depth + 1)
+                line_width = max(line_limit - len(content_indent), 1)
+                lines = [content[i:i + line_width].translate(TEXT_ESCAPES) for i in range(0, len(content), line_width)]
+                separator = f'\n{content_indent}'
+                extend((separator, separator.join(lines), f'\n{indent}</{tag_name}>'))
+        elif content is not None:
+            # Anchor tags containing only one tag are printed on the same line
+            if tag_name == 'a' and len(content) == 1:
+                push('</a>')
+                push((content[0], depth, True))
+            else:
+                push(f'\n{indent}</{tag_name}>')
+                child_depth = depth + 1
+                for child_tag in reversed(content):
+                    push((child_tag, child_depth, False))
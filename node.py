@@ -3,35 +3,87 @@
 @brief      Class representing an HTML node
 
 @date       8/3/2024
-@updated    8/17/2024
+@updated    10/14/2026
 
 @author     Preston Buterbaugh
 """
 # Imports
 from __future__ import annotations
 
-from typing import List, Dict
+import sys
+from itertools import count
+from typing import List, Dict, TYPE_CHECKING
 
 from htmlwriter.exceptions import NodeTypeException, DOMTreeException, AttributeTypeMismatch
 
+if TYPE_CHECKING:
+    from htmlwriter.document import Document
 
-SELF_CLOSING_TAGS = [
+
+SELF_CLOSING_TAGS = frozenset((
     'img',
     'br',
     'hr',
     'input'
-]
+))
 
-BOOLEAN_ATTRIBUTES = [
+BOOLEAN_ATTRIBUTES = frozenset((
     'checked',
     'disabled'
-]
+))
+
+# Translation tables for escaping characters with special meaning in HTML
+ATTRIBUTE_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'})
+TEXT_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+
+# Source of the internal IDs used to tell nodes apart within the DOM tree
+_node_ids = count(1)
+
+# Placeholder returned by attribute lookups when an attribute is not set, as None may be a stored value
+_MISSING = object()
+
+
+def _class_list(classes: str | List) -> List:
+    """
+    @brief  Converts class names to the list stored in a node's "class" attribute, dropping empty and repeated names
+    @param  classes (str or List): A space separated string of class names, or a list of class names
+    @return (List) The class names in their original order, each appearing once
+    """
+    if type(classes) is str:
+        classes = classes.split()
+    return list(dict.fromkeys(name for name in classes if name))
+
+
+def _child_position(children: List, child_index: Dict, child: Node) -> int:
+    """
+    @brief  Finds the position of a node in a list of child nodes, using an index of positions by internal node ID. If
+            the stored position is out of date, as positions shift when nodes are inserted or removed, the list is
+            scanned for the node and its entry in the index is corrected
+    @param  children    (List): The list of child nodes to search
+    @param  child_index (Dict): The index of positions in the list, keyed by internal node ID. Updated in place
+    @param  child       (Node): The node to find
+    @return (int) The position of the node in the list, or -1 if it is not in the list
+    """
+    position = child_index.get(child._node_id)
+    if position is not None and position < len(children) and children[position] is child:
+        return position
+    try:
+        # Nodes do not define equality, so list.index() matches by identity
+        position = children.index(child)
+    except ValueError:
+        child_index.pop(child._node_id, None)
+        return -1
+    child_index[child._node_id] = position
+    return position
 
 
 class Node:
     """
     @brief  Class representing an HTML node
     """
+    __slots__ = ('_node_id', 'tag_name', 'attributes', 'content', '_parent', '_child_index', '_document', '_attribute_cache',
+                 '_class_text_cache')
+
     def __init__(self, tag_name: str, attributes: Dict | None = None, content: str | List | None = None):
         """
         @brief  Constructor
@@ -42,33 +94,67 @@ class Node:
         # Handle parameter defaults
         if attributes is None:
             attributes = {}
+        elif type(attributes.get('class')) in (str, list):
+            # Normalize a copy, so the caller's dictionary is left as it was passed
+            attributes = {**attributes, 'class': _class_list(attributes['class'])}
         if content is None and tag_name not in SELF_CLOSING_TAGS:
             content = []
 
         # Check type of content
-        if content is not None and type(content) is not str and type(content) is not list:
-            raise TypeError(f'Parameter "content" expected type <str>, <list>, or <None>, but got {type(content)}')
-        if type(content) is list:
+        content_type = type(content)
+        if content is not None and content_type not in (str, list):
+            raise TypeError(f'Parameter "content" expected type <str>, <list>, or <None>, but got {content_type}')
+        if content_type is list:
             for node in content:
                 if type(node) is not Node:
                     raise TypeError(f'List value for parameter "content" should only contain Node objects, but contains {type(node)}')
 
         # Assign field values
-        self._node_id = 'Root'
-        self.tag_name = tag_name
+        self._node_id = next(_node_ids)
+        self.tag_name = sys.intern(tag_name)
         self.attributes = attributes
         self.content = content
-        self._max_id = 0
+        self._parent: Node | None = None
+        self._child_index: Dict | None = None
+        self._document: Document | None = None
+        self._attribute_cache = None
+        self._class_text_cache = None
+        if content_type is list:
+            for node in content:
+                node._parent = self
+
+    def _attribute_text(self) -> str:
+        """
+        @brief  Renders the node's attributes as they appear in its opening tag, reusing the previous rendering if the
+                attributes have not changed since
+        @return (str) The attribute text, with a leading space before each attribute
+        """
+        if self._attribute_cache is not None and self._attribute_cache[0] == self.attributes:
+            return self._attribute_cache[1]
+
+        snapshot = dict(self.attributes)
+        rendered = []
+        for attribute, value in snapshot.items():
+            if attribute == 'class' and type(value) is list:
+                snapshot[attribute] = list(value)
+                value = ' '.join(value)
+            rendered.append(f' {attribute}="{str(value).translate(ATTRIBUTE_ESCAPES)}"')
+        text = ''.join(rendered)
+        self._attribute_cache = (snapshot, text)
+        return text
 
-    def _update_node_ids(self, new_id: str):
+    def _class_text(self, classes: List) -> str:
         """
-        @brief  Updates the node's ID and the IDs of all child nodes
-        @param  new_id (str): The new ID being assigned to the root node
+        @brief  Joins the node's class names into the text of its class attribute, reusing the previous result if the
+                class names have not changed since
+        @param  classes (List): The node's current list of class names
+        @return (str) The class names, separated by spaces
         """
-        self._node_id = new_id
-        if type(self.content) is list:
-            for node in self.content:
-                node._update_node_ids(f'{new_id}{node._node_id[4:]}')
+        if self._class_text_cache is not None and self._class_text_cache[0] == classes:
+            return self._class_text_cache[1]
+        text = ' '.join(classes)
+        self._class_text_cache = (list(classes), text)
+        return text
 
     # Get/set functions for node identification attributes
     def id(self, new_id: str | None = None) -> str | None:
@@ -88,14 +174,12 @@ class Node:
         @return (List) A list containing all class names associated with the node
         """
         if classes is None:
-            try:
-                return self.attributes['class']
-            except KeyError:
-                return []
+            return self.attributes.get('class', [])
         else:
-            if type(classes) is str:
-                classes = classes.split(' ')
+            classes = _class_list(classes)
             self.attributes['class'] = classes
+            if self._document is not None:
+                self._document._dom_changed()
             return classes
 
     def add_class(self, class_name: str):
@@ -103,19 +187,24 @@ class Node:
         @brief  Adds a new class to the node
         @param  class_name (str): The name of the class to add
         """
-        if 'class' in self.attributes.keys():
-            if class_name not in self.attributes['class']:
-                self.attributes['class'].append(class_name)
-        else:
+        classes = self.attributes.get('class')
+        if classes is None:
             self.attributes['class'] = [class_name]
+        elif class_name not in classes:
+            classes.append(class_name)
+        if self._document is not None:
+            self._document._dom_changed()
 
     def remove_class(self, class_name: str):
         """
         @brief  Removes a class name from the node
         @param  class_name (str): The name of the class to remove
         """
-        if 'class' in self.attributes.keys() and class_name in self.attributes['class']:
-            self.attributes['class'].remove(class_name)
+        classes = self.attributes.get('class')
+        if classes and class_name in classes:
+            classes.remove(class_name)
+            if self._document is not None:
+                self._document._dom_changed()
 
     # Get/set functions for link attributes
     def href(self, href: str | None = None) -> str | None:
@@ -242,7 +331,7 @@ class Node:
         return self.attr('d', d)
 
     # Get/set function for the style attribute
-    def style(self, style: str | None) -> str | None:
+    def style(self, style: str | None = None) -> str | None:
         """
         @brief  Gets or sets the CSS style attribute for the node. Shorthand for attr('style', value)
         @param  style (str): A new CSS style for the node
@@ -262,17 +351,22 @@ class Node:
         @return (str, bool, or None): The current value of the attribute after the function, or None if the attribute is
                                       not set on the node
         """
+        attribute = sys.intern(attribute)
         if value is None:
-            try:
-                if attribute == 'class':
-                    return ' '.join(self.attributes[attribute])
-                return self.attributes[attribute]
-            except KeyError:
+            current_value = self.attributes.get(attribute, _MISSING)
+            if current_value is _MISSING:
                 if attribute in BOOLEAN_ATTRIBUTES:
                     return False
                 else:
                     return None
+            if attribute == 'class' and type(current_value) is list:
+                return self._class_text(current_value)
+            return current_value
         elif value == '':
+            if attribute == 'id' and self._document is not None:
+                self._document._unregister_id(self)
+            if attribute == 'class' and self._document is not None:
+                self._document._dom_changed()
             self.attributes.pop(attribute, None)
             return None
         else:
@@ -286,7 +380,12 @@ class Node:
 
             # Set attribute
             if attribute == 'class':
-                value = value.split(' ')
+                value = _class_list(value)
+            if attribute == 'id' and self._document is not None:
+                self._document._unregister_id(self)
+                self._document._register_id(self, value)
+            if attribute == 'class' and self._document is not None:
+                self._document._dom_changed()
             self.attributes[attribute] = value
             return value
 
@@ -298,14 +397,20 @@ class Node:
         @return (str or None): The text content of the node after it is set. None is returned if the node contains HTML
                                nodes instead of text
         """
+        content_type = type(self.content)
         if text is None:
-            if type(self.content) is str:
+            if content_type is str:
                 return self.content
-            elif type(self.content) is list and len(self.content) == 0:
+            elif content_type is list and len(self.content) == 0:
                 return ''
             else:
                 return None
         else:
+            if content_type is list:
+                for node in self.content:
+                    node._parent = None
+                    if self._document is not None:
+                        self._document._unregister_ids(node)
             self.content = text
 
     def get_child_nodes(self) -> List | None:
@@ -313,12 +418,13 @@ class Node:
         @brief  Returns a list of all the node's child nodes
         @return A list of all child nodes, or none if it is a text node or a self-closing tag
         """
-        if self.content is None or (type(self.content) is str and self.content != ''):
-            return None
-        elif self.content == '':
+        content_type = type(self.content)
+        if content_type is list:
+            return self.content
+        elif content_type is str and self.content == '':
             return []
         else:
-            return self.content
+            return None
 
     def get_by_id(self, search_id: str) -> Node | None:
         """
@@ -328,15 +434,56 @@ class Node:
         """
         if type(self.content) is not list:
             return None
-        else:
-            for node in self.content:
-                if 'id' in node.attributes.keys() and node.attributes['id'] == search_id:
-                    return node
-                if type(node.content) is list:
-                    sub_node = node.get_by_id(search_id)
-                    if sub_node is not None:
-                        return sub_node
-            return None
+
+        # Within a document, only the nodes in the document's ID index need to be checked. Each one is confirmed to still
+        # have the ID and be within this node, as both may have been changed by editing the node's fields directly. The
+        # tree is still searched if several nodes match, or if none do, as nodes may also have been added that way
+        if self._document is not None:
+            matching_nodes = [node for node in self._document._id_index.get(search_id, [])
+                              if node.attributes.get('id') == search_id and self._is_ancestor_of(node)]
+            if len(matching_nodes) == 1:
+                return matching_nodes[0]
+
+        stack = self.content[::-1]
+        pop = stack.pop
+        push = stack.extend
+        while stack:
+            node = pop()
+            if node.attributes.get('id') == search_id:
+                return node
+            children = node.content
+            if type(children) is list:
+                push(reversed(children))
+        return None
+
+    def _is_ancestor_of(self, node: Node) -> bool:
+        """
+        @brief  Checks whether a node is contained, at any depth, within this node
+        @param  node (Node): The node to check
+        @return (bool) True if this node is one of the node's ancestors
+        """
+        ancestor = node._parent
+        while ancestor is not None:
+            if not ancestor._has_child(node):
+                return False
+            if ancestor is self:
+                return True
+            node = ancestor
+            ancestor = node._parent
+        return False
+
+    def _has_child(self, child: Node) -> bool:
+        """
+        @brief  Checks whether a node is one of this node's direct children, as a child's parent link is not updated if
+                the content list is edited directly
+        @param  child (Node): The node to check
+        @return (bool) True if the node is in this node's content list
+        """
+        if type(self.content) is not list:
+            return False
+        if self._child_index is None:
+            self._child_index = {}
+        return _child_position(self.content, self._child_index, child) != -1
 
     def get_by_class_name(self, class_name: str) -> List:
         """
@@ -345,12 +492,20 @@ class Node:
         @return (List) A list of all nodes containing the specified class
         """
         matching_nodes = []
-        if type(self.content) is list:
-            for node in self.content:
-                if 'class' in node.attributes.keys() and class_name in node.attributes['class']:
-                    matching_nodes.append(node)
-                if type(node.content) is list:
-                    matching_nodes = matching_nodes + node.get_by_class_name(class_name)
+        if type(self.content) is not list:
+            return matching_nodes
+        stack = self.content[::-1]
+        pop = stack.pop
+        push = stack.extend
+        append = matching_nodes.append
+        while stack:
+            node = pop()
+            classes = node.attributes.get('class')
+            if classes and class_name in classes:
+                append(node)
+            children = node.content
+            if type(children) is list:
+                push(reversed(children))
         return matching_nodes
 
     def get_by_tag_name(self, tag_name: str) -> List:
@@ -359,13 +514,21 @@ class Node:
         @param  tag_name (str): The tag name to search for
         @return (List) A list of all nodes matching the specified tag name
         """
+        tag_name = sys.intern(tag_name)
         matching_nodes = []
-        if type(self.content) is list:
-            for node in self.content:
-                if node.tag_name == tag_name:
-                    matching_nodes.append(node)
-                if type(node.content) is list:
-                    matching_nodes = matching_nodes + node.get_by_tag_name(tag_name)
+        if type(self.content) is not list:
+            return matching_nodes
+        stack = self.content[::-1]
+        pop = stack.pop
+        push = stack.extend
+        append = matching_nodes.append
+        while stack:
+            node = pop()
+            if node.tag_name == tag_name:
+                append(node)
+            children = node.content
+            if type(children) is list:
+                push(reversed(children))
         return matching_nodes
 
     # Functions for mutating node content
@@ -376,26 +539,31 @@ class Node:
         @param  insert_node (Node): The node to be inserted
         """
         # Check node type
-        if type(self.content) is str and self.content != '':
+        content = self.content
+        content_type = type(content)
+        if content_type is str and content != '':
             raise NodeTypeException('Cannot insert an HTML node into a node with text content')
-        elif self.content is None:
+        elif content is None:
             raise NodeTypeException('Cannot insert an HTML node into a self-closing tag')
         else:
-            # Find node to insert before
-            before_index = -1
-            for i, node in enumerate(self.content):
-                if node._node_id == before_node._node_id:
-                    before_index = i
-                    break
+            # Find node to insert before. A node with empty text content has no children to insert before
+            if content_type is str:
+                before_index = -1
+            else:
+                if self._child_index is None:
+                    self._child_index = {}
+                before_index = _child_position(content, self._child_index, before_node)
 
             # Raise exception if node not found
             if before_index == -1:
                 raise DOMTreeException('Node insertion failed. Node to insert before is not a child of the node on which the insertion is to be made')
 
             # Insert node
-            self._max_id = self._max_id + 1
-            insert_node._update_node_ids(f'{self._node_id}>{self._max_id}')
-            self.content = self.content[0:before_index] + [insert_node] + self.content[before_index:]
+            insert_node._parent = self
+            document = self._document
+            if document is not None:
+                document._register_ids([insert_node])
+            content.insert(before_index, insert_node)
 
     def append_child(self, append_node: Node):
         """
@@ -403,16 +571,53 @@ class Node:
         @param  (Node) append_node: The node to append
         """
         # Check node type
-        if type(self.content) is str and self.content != '':
+        content = self.content
+        content_type = type(content)
+        if content_type is str and content != '':
+            raise NodeTypeException('Cannot insert HTML node into text node')
+        elif content is None:
+            raise NodeTypeException('Cannot insert HTML node into self-closing tag')
+        else:
+            if content_type is str:
+                content = self.content = []
+            append_node._parent = self
+            document = self._document
+            if document is not None:
+                document._register_ids([append_node])
+            if self._child_index is None:
+                self._child_index = {}
+            self._child_index[append_node._node_id] = len(content)
+            content.append(append_node)
+
+    def append_children(self, append_nodes: List):
+        """
+        @brief  Inserts several new nodes at the end of the node's DOM tree at once, in the order given
+        @param  (List) append_nodes: The nodes to append
+        """
+        append_nodes = list(append_nodes)
+
+        # Check node type
+        content = self.content
+        content_type = type(content)
+        if content_type is str and content != '':
             raise NodeTypeException('Cannot insert HTML node into text node')
-        elif self.content is None:
+        elif content is None:
             raise NodeTypeException('Cannot insert HTML node into self-closing tag')
         else:
-            if type(self.content) is str:
-                self.content = []
-            self._max_id = self._max_id + 1
-            append_node._update_node_ids(f'{self._node_id}>{self._max_id}')
-            self.content.append(append_node)
+            if content_type is str:
+                content = self.content = []
+            child_index = self._child_index
+            if child_index is None:
+                child_index = self._child_index = {}
+            position = len(content)
+            for append_node in append_nodes:
+                append_node._parent = self
+                child_index[append_node._node_id] = position
+                position += 1
+            document = self._document
+            if document is not None:
+                document._register_ids(append_nodes)
+            content.extend(append_nodes)
 
     def remove_child(self, remove_node: Node):
         """
@@ -420,20 +625,25 @@ class Node:
         @param  remove_node (str): The node to remove
         """
         # Check node type
-        if type(self.content) is str:
+        content = self.content
+        if type(content) is str:
             raise NodeTypeException('Cannot remove HTML element from text node')
-        elif self.content is None:
+        elif content is None:
             raise NodeTypeException('Cannot remove HTML element from self-closing tag')
         else:
             # Find node to remove
-            remove_index = -1
-            for i, node in enumerate(self.content):
-                if node._node_id == remove_node._node_id:
-                    remove_index = i
-                    break
+            child_index = self._child_index
+            if child_index is None:
+                child_index = self._child_index = {}
+            remove_index = _child_position(content, child_index, remove_node)
 
             # Raise exception if node not found
             if remove_index == -1:
                 raise DOMTreeException('Node removal failed. The node to be removed is not a child of the node to remove it from')
 
-            self.content.pop(remove_index)
+            removed_node = content.pop(remove_index)
+            child_index.pop(removed_node._node_id, None)
+            removed_node._parent = None
+            document = self._document
+            if document is not None:
+                document._unregister_ids(removed_node)